@@ -1,4 +1,3 @@
-# -*- coding: utf-8 -*-
 ##############################################################################
 #
 #    pyFlyDoc, python library for FlyDoc webservices
@@ -23,10 +22,24 @@
 ##############################################################################
 
 import os
-import base64
-import pkg_resources
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, IntEnum
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # SIMD-accelerated drop-in replacement, noticeably faster on big attachments
+    from pybase64 import b64encode
+except ImportError:
+    from base64 import b64encode
+
+from importlib.resources import files
+from suds.cache import ObjectCache
 from suds.client import Client
+from suds.transport import Reply, TransportError
+from suds.transport.http import HttpTransport
 
 
 class FlyDocTransportName(Enum):
@@ -42,6 +55,13 @@ class FlyDocTransportName(Enum):
     UserForm = 'User form'
     FaxRecv = 'Received Fax'
 
+    @classmethod
+    def from_value(cls, value):
+        """
+        Returns the member for the supplied value, as a single dict lookup
+        """
+        return cls._by_value[value]
+
 
 class FlyDocTransportState(IntEnum):
     Queued = 0
@@ -58,14 +78,110 @@ class FlyDocTransportState(IntEnum):
     Canceled = 300
     Rejected = 400
 
+    @classmethod
+    def from_value(cls, value):
+        """
+        Returns the member for the supplied value, as a single dict lookup
+        """
+        return cls._by_value[value]
+
+
+# Reverse maps used by from_value, to translate raw service values to enum
+# members without iterating over the members
+FlyDocTransportName._by_value = {member.value: member for member in FlyDocTransportName}
+FlyDocTransportState._by_value = {member.value: member for member in FlyDocTransportState}
+
+# Size of the chunks read when encoding attachment files, a multiple of 3 so
+# that base64 never pads in the middle of the stream
+_B64_CHUNK_SIZE = 57 * 1024
+
+# Bundled WSDL files, resolved once at import time
+_SESSION_WSDL = (files('pyflydoc') / 'WSDL' / 'SessionService.wsdl').as_uri()
+_SUBMISSION_WSDL = (files('pyflydoc') / 'WSDL' / 'SubmissionService.wsdl').as_uri()
+_QUERY_WSDL = (files('pyflydoc') / 'WSDL' / 'QueryService.wsdl').as_uri()
+
+
+def _cacheLocation():
+    """
+    Returns the directory holding the parsed WSDL cache
+    Overridable through the PYFLYDOC_CACHE_DIR environment variable
+    """
+    return os.environ.get('PYFLYDOC_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'pyflydoc')
+
+
+# HTTP session shared by all clients, keeping connections alive between SOAP
+# calls instead of paying a TCP and TLS handshake for each one
+_httpSession = requests.Session()
+_httpSession.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=3))
+_httpSession.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=3))
+
+
+class FlyDocHttpTransport(HttpTransport):
+    """
+    suds transport backed by the shared requests session, pooling connections
+    across SOAP calls
+    """
+    def open(self, request):
+        # Local WSDL files are not handled by requests, let suds open them
+        if not request.url.startswith(('http://', 'https://')):
+            return HttpTransport.open(self, request)
+
+        response = _httpSession.get(request.url, headers=request.headers, timeout=self.options.timeout)
+        if response.status_code >= 400:
+            raise TransportError(response.reason, response.status_code, BytesIO(response.content))
+        return BytesIO(response.content)
+
+    def send(self, request):
+        response = _httpSession.post(request.url, data=request.message, headers=request.headers, timeout=self.options.timeout)
+        if response.status_code >= 400:
+            # suds parses the soap fault itself out of a 500 TransportError
+            raise TransportError(response.reason, response.status_code, BytesIO(response.content))
+        return Reply(response.status_code, response.headers, response.content)
+
 
 class FlyDocService(object):
     """
     Base for FlyDoc services classes
     Loads the WSDL file at instanciation and defines some helpers to simplify written code
     """
+    __slots__ = ('client', '_set_options', '_soapMethods')
+
+    # Cache shared by all services, storing the pickled parsed WSDL object trees
+    # instead of the raw documents, to avoid a full re-parse on each instanciation.
+    # Kept in a per-user directory rather than the temporary files directory, so
+    # that it survives across processes and is not shared between users
+    cache = ObjectCache(location=_cacheLocation(), days=7)
+
     def __init__(self, wsdlFile):
-        self.client = Client(wsdlFile)
+        # A dedicated client per instance keeps options and soap headers
+        # independent across sessions. suds' clone() cannot be used to share one
+        # parsed client, as deep-copying its options recurses forever on Python 3 ;
+        # construction stays cheap since the WSDL comes from the shared cache.
+        # cachingpolicy 1 caches the parsed WSDL objects, not just the raw documents
+        self.client = Client(wsdlFile, cache=self.cache, cachingpolicy=1, transport=FlyDocHttpTransport())
+
+        # Pre-bind the client helpers, and the SOAP methods in a dict served by
+        # __getattr__ : keeping them out of ad-hoc instance attributes is what
+        # allows the classes to use __slots__
+        self._set_options = self.client.set_options
+        self._soapMethods = {
+            methodName: getattr(self.client.service, methodName)
+            for methodName in self.client.wsdl.services[0].ports[0].methods
+        }
+
+    # Factory-created enumeration constants, cached per WSDL file : they are
+    # stateless values fully determined by the schema
+    _enum_cache = {}
+
+    def _createEnum(self, wsdlFile, name):
+        """
+        Returns the enumeration complex type instance for the supplied name,
+        walking the WSDL schema only on the first request per WSDL file
+        """
+        key = (wsdlFile, name)
+        if key not in self._enum_cache:
+            self._enum_cache[key] = self.client.factory.create(name)
+        return self._enum_cache[key]
 
     def _create(self, name, values=None):
         """
@@ -100,52 +216,77 @@ class FlyDocService(object):
         """
         Binds method calls on the class, and all other calls prefixed by an underscore
         """
-        if name.startswith('_') and hasattr(self.client, name[1:]):
-            return getattr(self.client, name[1:])
+        if name in FlyDocService.__slots__:
+            # Slot not filled yet, avoid recursing through self.client below
+            raise AttributeError(name)
+
+        try:
+            return self._soapMethods[name]
+        except KeyError:
+            pass
 
-        if hasattr(self.client.service, name):
-            return getattr(self.client.service, name)
+        client = self.client
+        if name[:1] == '_':
+            try:
+                return getattr(client, name[1:])
+            except AttributeError:
+                pass
 
-        raise AttributeError('Unknown attribute %s' % name)
+        try:
+            return getattr(client.service, name)
+        except AttributeError:
+            raise AttributeError('Unknown attribute %s' % name) from None
 
 
 class FlyDocSessionService(FlyDocService):
     """
     Session Service class
     """
-    def __init__(self, wsdlFile=None):
-        if wsdlFile is None:
-            wsdlFile = 'file://' + pkg_resources.resource_filename('pyflydoc', 'WSDL/SessionService.wsdl')
+    __slots__ = ()
 
-        super(FlyDocSessionService, self).__init__(wsdlFile)
+    def __init__(self, wsdlFile=None):
+        super().__init__(wsdlFile or _SESSION_WSDL)
 
 
 class FlyDocSubmissionService(FlyDocService):
     """
     Submission Service class
     """
-    def __init__(self, wsdlFile=None):
-        if wsdlFile is None:
-            wsdlFile = 'file://' + pkg_resources.resource_filename('pyflydoc', 'WSDL/SubmissionService.wsdl')
+    __slots__ = ('ATTACHMENTS_FILTER', 'RESOURCE_TYPE', 'WSFILE_MODE', 'VAR_TYPE')
 
-        super(FlyDocSubmissionService, self).__init__(wsdlFile)
+    def __init__(self, wsdlFile=None):
+        wsdlFile = wsdlFile or _SUBMISSION_WSDL
+        super().__init__(wsdlFile)
 
         # Initialize enumeration constants
-        self.ATTACHMENTS_FILTER = self.client.factory.create('ATTACHMENTS_FILTER')
-        self.RESOURCE_TYPE = self.client.factory.create('RESOURCE_TYPE')
-        self.WSFILE_MODE = self.client.factory.create('WSFILE_MODE')
-        self.VAR_TYPE = self.client.factory.create('VAR_TYPE')
+        self.ATTACHMENTS_FILTER = self._createEnum(wsdlFile, 'ATTACHMENTS_FILTER')
+        self.RESOURCE_TYPE = self._createEnum(wsdlFile, 'RESOURCE_TYPE')
+        self.WSFILE_MODE = self._createEnum(wsdlFile, 'WSFILE_MODE')
+        self.VAR_TYPE = self._createEnum(wsdlFile, 'VAR_TYPE')
 
-    def _readFile(self, attachment):
+    def _encodeFile(self, attachment):
+        """
+        Reads and base64-encodes the contents of the supplied attachment file
+        @param attachment : Name of the file to read
+        """
+        # Read and encode by chunks to keep the working set bounded, instead of
+        # holding both the file and its encoded copy in memory at once
+        chunks = []
+        with open(attachment, 'rb') as fil:
+            for chunk in iter(lambda: fil.read(_B64_CHUNK_SIZE), b''):
+                chunks.append(b64encode(chunk))
+        return b''.join(chunks).decode('ascii')
+
+    def _readFile(self, attachment, content=None):
         """
         Creates a WSFile object, with contents of the supplied attachment file
         @param attachment : Name of the file to read
+        @param content : Already encoded contents, read from disk when not supplied
         """
         wsFile = self._create('WSFile')
         wsFile.name = os.path.basename(attachment)
         wsFile.mode = self.WSFILE_MODE.MODE_INLINED
-        with open(attachment, 'r') as fil:
-            wsFile.content = base64.b64encode(fil.read())
+        wsFile.content = content if content is not None else self._encodeFile(attachment)
 
         return wsFile
 
@@ -158,7 +299,7 @@ class FlyDocSubmissionService(FlyDocService):
         wsFile = self._create('WSFile')
         wsFile.name = name
         wsFile.mode = self.WSFILE_MODE.MODE_INLINED
-        wsFile.content = base64.b64encode(data)
+        wsFile.content = b64encode(data).decode('ascii')
         return wsFile
 
 
@@ -166,39 +307,85 @@ class FlyDocQueryService(FlyDocService):
     """
     Query Service class
     """
-    def __init__(self, wsdlFile=None):
-        if wsdlFile is None:
-            wsdlFile = 'file://' + pkg_resources.resource_filename('pyflydoc', 'WSDL/QueryService.wsdl')
+    __slots__ = ('ATTACHMENTS_FILTER', 'WSFILE_MODE', 'VAR_TYPE')
 
-        super(FlyDocQueryService, self).__init__(wsdlFile)
+    def __init__(self, wsdlFile=None):
+        wsdlFile = wsdlFile or _QUERY_WSDL
+        super().__init__(wsdlFile)
 
         # Initialize enumeration constants
-        self.ATTACHMENTS_FILTER = self.client.factory.create('ATTACHMENTS_FILTER')
-        self.WSFILE_MODE = self.client.factory.create('WSFILE_MODE')
-        self.VAR_TYPE = self.client.factory.create('VAR_TYPE')
+        self.ATTACHMENTS_FILTER = self._createEnum(wsdlFile, 'ATTACHMENTS_FILTER')
+        self.WSFILE_MODE = self._createEnum(wsdlFile, 'WSFILE_MODE')
+        self.VAR_TYPE = self._createEnum(wsdlFile, 'VAR_TYPE')
 
 
 class FlyDoc(object):
     """
     General FlyDoc class
     """
+    __slots__ = (
+        '_sessionServiceWsdlFile', '_submissionServiceWsdlFile', '_queryServiceWsdlFile',
+        '_sessionService', '_submissionService', '_queryService',
+        '_serviceLocations', '_sessionHeaderValue', 'loginInfo',
+    )
+
     def __init__(self, sessionServiceWsdlFile=None, submissionServiceWsdlFile=None, queryServiceWsdlFile=None):
         """
-        Initialize services instances from WSDL files
+        Store the WSDL files, each service being instanciated on first use
         """
-        self.sessionService = FlyDocSessionService(sessionServiceWsdlFile)
-        self.submissionService = FlyDocSubmissionService(submissionServiceWsdlFile)
-        self.queryService = FlyDocQueryService(queryServiceWsdlFile)
-
-    def login(self, username, password):
+        self._sessionServiceWsdlFile = sessionServiceWsdlFile
+        self._submissionServiceWsdlFile = submissionServiceWsdlFile
+        self._queryServiceWsdlFile = queryServiceWsdlFile
+        self._sessionService = None
+        self._submissionService = None
+        self._queryService = None
+        self._serviceLocations = {}
+        self._sessionHeaderValue = None
+
+    def _configureService(self, service, name):
+        """
+        Applies the session location and header on a newly instanciated service
+        """
+        location = self._serviceLocations.get(name)
+        if location is not None:
+            service._set_options(location=location)
+        if self._sessionHeaderValue is not None:
+            service._addHeader('SessionHeaderValue', self._sessionHeaderValue)
+        return service
+
+    @property
+    def sessionService(self):
+        if self._sessionService is None:
+            self._sessionService = self._configureService(FlyDocSessionService(self._sessionServiceWsdlFile), 'session')
+        return self._sessionService
+
+    @property
+    def submissionService(self):
+        if self._submissionService is None:
+            self._submissionService = self._configureService(FlyDocSubmissionService(self._submissionServiceWsdlFile), 'submission')
+        return self._submissionService
+
+    @property
+    def queryService(self):
+        if self._queryService is None:
+            self._queryService = self._configureService(FlyDocQueryService(self._queryServiceWsdlFile), 'query')
+        return self._queryService
+
+    def login(self, username, password, useCachedBindings=False):
         """
         Initialize the services by retrieving a session identifier
+        @param useCachedBindings : Reuse the service locations retrieved by a
+        previous login instead of calling GetBindings again
         """
-        # Initialize services bindings
-        bindings = self.sessionService.GetBindings(username)
-        self.sessionService._set_options(location=str(bindings.sessionServiceLocation))
-        self.submissionService._set_options(location=str(bindings.submissionServiceLocation))
-        self.queryService._set_options(location=str(bindings.queryServiceLocation))
+        # Initialize services bindings, converting the locations to plain strings
+        # a single time
+        if not (useCachedBindings and self._serviceLocations):
+            bindings = self.sessionService.GetBindings(username)
+            self._serviceLocations = {
+                'session': str(bindings.sessionServiceLocation),
+                'submission': str(bindings.submissionServiceLocation),
+                'query': str(bindings.queryServiceLocation),
+            }
 
         # Call the login method
         self.loginInfo = self.sessionService.Login(userName=username, password=password)
@@ -206,11 +393,14 @@ class FlyDoc(object):
         # Define the session header value
         SessionHeaderValue = self.sessionService._create('SessionHeader')
         SessionHeaderValue.sessionID = self.loginInfo.sessionID
+        self._sessionHeaderValue = SessionHeaderValue
 
-        # Set the proper header values
-        self.sessionService._addHeader('SessionHeaderValue', SessionHeaderValue)
-        self.submissionService._addHeader('SessionHeaderValue', SessionHeaderValue)
-        self.queryService._addHeader('SessionHeaderValue', SessionHeaderValue)
+        # Set the proper values on already instanciated services, the others will
+        # be configured when first used
+        for name, service in (('session', self._sessionService), ('submission', self._submissionService), ('query', self._queryService)):
+            if service is not None:
+                service._set_options(location=self._serviceLocations[name])
+                service._addHeader('SessionHeaderValue', SessionHeaderValue)
 
     def logout(self):
         """
@@ -228,68 +418,101 @@ class FlyDoc(object):
         if transportContents is None:
             transportContents = {}
 
+        # Bind the service and its helpers once, instead of once per element
+        submissionService = self.submissionService
+        create = submissionService._create
+        readFile = submissionService._readFile
+        createFile = submissionService._createFile
+        varType = submissionService.VAR_TYPE.TYPE_STRING
+
         # Create a new transport
-        transport = self.submissionService._create('Transport')
+        transport = create('Transport')
         transport.transportName = name
 
         # Add vars in the transport
-        transport.vars.Var.extend([self.submissionService._create('Var', {
+        transport.vars.Var.extend([create('Var', {
             'attribute': attribute,
             'simpleValue': value,
-            'type': self.submissionService.VAR_TYPE.TYPE_STRING,
+            'type': varType,
         }) for attribute, value in transportVars.items()])
 
-        # Add files in attachments
-        transport.attachments.Attachment.extend([self.submissionService._create('Attachment', {
-            'sourceAttachment': self.submissionService._readFile(attachment),
-        }) for attachment in transportAttachments])
-        # Add direct contents in attachments
-        transport.attachments.Attachment.extend([self.submissionService._create('Attachment', {
-            'sourceAttachment': self.submissionService._createFile(content['name'], content['data'])
-        }) for content in transportContents])
+        # Read and encode attachment files in parallel : disk reads overlap with
+        # the encoding of the other files. The WSFile objects are still built
+        # sequentially, as the suds factory is not thread-safe
+        if transportAttachments:
+            with ThreadPoolExecutor(max_workers=min(8, len(transportAttachments))) as executor:
+                contents = list(executor.map(submissionService._encodeFile, transportAttachments))
+        else:
+            contents = []
+
+        # Add files and direct contents in attachments, built as a single list to
+        # extend the transport only once
+        attachments = [create('Attachment', {
+            'sourceAttachment': readFile(attachment, content),
+        }) for attachment, content in zip(transportAttachments, contents)]
+        attachments += [create('Attachment', {
+            'sourceAttachment': createFile(content['name'], content['data']),
+        }) for content in transportContents]
+        transport.attachments.Attachment.extend(attachments)
 
         # Submit the transport
-        return self.submissionService.SubmitTransport(transport=transport)
+        return submissionService.SubmitTransport(transport=transport)
 
-    def browse(self, filter='msn=*', sortOrder='', attributes='', nItems=None, includeSubNodes=False, searchInArchive=False, reverse=False):
+    def browse(self, filter='msn=*', sortOrder='', attributes='', nItems=None, includeSubNodes=False, searchInArchive=False, reverse=False, batchSize=50):
         """
         Generator used to browse transports
+        Transports are requested from the service batchSize at a time, to save one
+        SOAP round trip per transport, and are still yielded one by one
         """
+        queryService = self.queryService
+        # Select the query methods once, depending on the order, instead of
+        # branching on reverse at each iteration
+        if not reverse:
+            queryStart, queryStep = queryService.QueryFirst, queryService.QueryNext
+        else:
+            queryStart, queryStep = queryService.QueryLast, queryService.QueryPrevious
+
         # Create QueryRequest object
-        request = self.queryService._create('QueryRequest')
-        # Request for transports one by one for the generator to work
-        request.nItems = 1
+        request = queryService._create('QueryRequest')
+        # Request for transports by batches
+        request.nItems = batchSize if nItems is None else min(batchSize, nItems)
         request.filter = filter
         request.sortOrder = sortOrder
         request.attributes = attributes
         request.includeSubNodes = includeSubNodes
         request.searchInArchive = searchInArchive
 
-        # Request for the first or last item, depending on the order
-        if not reverse:
-            result = self.queryService.QueryFirst(request)
-        else:
-            result = self.queryService.QueryLast(request)
+        # Request for the first or last batch, depending on the order
+        result = queryStart(request)
 
-        totalNumber = result.nTransports
+        totalNumber = 0
         # Check if there is at least one result
         if result.nTransports > 0:
-            yield result.transports.Transport[0]
-
-        # Add the queryID in headers (required)
-        QueryHeaderValue = self.queryService._create('QueryHeader')
-        QueryHeaderValue.queryID = self.queryService._getLastResponseHeaders().getChild('QueryHeaderValue').getChild('queryID').getText()
-        self.queryService._addHeader('QueryHeaderValue', QueryHeaderValue)
-        while(not result.noMoreItems and (nItems is not None and totalNumber < nItems)):
-            # Request for the next item, depending on the order
-            if not reverse:
-                result = self.queryService.QueryNext(request)
-            else:
-                result = self.queryService.QueryPrevious(request)
-
-            totalNumber += result.nTransports
+            for transport in result.transports.Transport:
+                yield transport
+                totalNumber += 1
+                if nItems is not None and totalNumber >= nItems:
+                    return
+
+        # Check if further batches have to be requested
+        if result.noMoreItems or (nItems is not None and totalNumber >= nItems):
+            return
+
+        # Add the queryID in headers (required by QueryNext/QueryPrevious), walking
+        # the response envelope only once, and only when a next batch is needed
+        QueryHeaderValue = queryService._create('QueryHeader')
+        QueryHeaderValue.queryID = queryService._getLastResponseHeaders().getChild('QueryHeaderValue').getChild('queryID').getText()
+        queryService._addHeader('QueryHeaderValue', QueryHeaderValue)
+        while(not result.noMoreItems and (nItems is None or totalNumber < nItems)):
+            # Request for the next batch, in the selected order
+            result = queryStep(request)
+
             if result.nTransports > 0:
-                yield result.transports.Transport[0]
+                for transport in result.transports.Transport:
+                    yield transport
+                    totalNumber += 1
+                    if nItems is not None and totalNumber >= nItems:
+                        return
 
     def browseAttachments(self, transportID, attachmentFilter=None, outputFileMode=None):
         """
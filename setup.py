@@ -1,4 +1,3 @@
-# -*- coding: utf-8 -*-
 ##############################################################################
 #
 #    pyFlyDoc, python library for FlyDoc webservices
@@ -37,11 +36,11 @@ setup(
     description='Python library for FlyDoc webservices',
     long_description=open('README.txt').read(),
     requires=[
-        'suds_jurko (>=0.6)',
-        'enum34',
+        'suds (>=1.0)',
+        'requests',
     ],
     install_requires=[
-        'suds_jurko >= 0.6',
-        'enum34',
+        'suds >= 1.0',
+        'requests',
     ],
 )